@@ -14,15 +14,26 @@ You could invoke this program, for example, in a git pre-commit hook.
 # TODO: Thanks to https://github.com/google/google-java-format/pull/106
 # this script can be eliminated, or its interface simplified.
 
-import filecmp
+import argparse
+import concurrent.futures
+import dataclasses
+import difflib
+import functools
+import hashlib
+import importlib.util
 import itertools
+import json
 import os
 import shutil
 import stat
 import subprocess
 import sys
 import tempfile
+import time
+from collections import Counter, defaultdict
 from pathlib import Path
+from types import ModuleType
+from typing import Any
 
 try:
     from urllib import urlopen  # ty: ignore[unresolved-import]
@@ -36,6 +47,9 @@ script_dir = Path(__file__).resolve().parent
 run_py_name = "run-google-java-format.py"
 run_py_path = script_dir / run_py_name
 
+# Git index modes of regular files, non-executable and executable.
+regular_file_modes = ("100644", "100755")
+
 
 # For some reason, the "git ls-files" must be run from the root.
 # (I can run "git ls-files" from the command line in any directory.)
@@ -88,78 +102,665 @@ def urlretrieve(url: str, filename: Path) -> None:
     tmp_path.rename(filename)
 
 
-# Don't replace local with remote if local is under version control.
-# It would be better to just test whether the remote is newer than local,
-# but raw GitHub URLs don't have the necessary last-modified information.
-if not under_git(script_dir, run_py_name):
-    url = "https://raw.githubusercontent.com/plume-lib/run-google-java-format/master/" + run_py_name
-    try:
-        urlretrieve(url, run_py_path)
-    except Exception:  # ruff:ignore[blind-except]
-        if run_py_path.exists():
-            print("Couldn't retrieve " + run_py_name + " from " + url + "; using cached version")
+def run_module() -> ModuleType:
+    """Return run-google-java-format.py, loaded as a module.
+
+    Retrieves the latest version first, unless the local copy is under version control.
+
+    Returns:
+        the run-google-java-format.py module.
+    """
+    # Don't replace local with remote if local is under version control.
+    # It would be better to just test whether the remote is newer than local,
+    # but raw GitHub URLs don't have the necessary last-modified information.
+    if not under_git(script_dir, run_py_name):
+        url = (
+            "https://raw.githubusercontent.com/plume-lib/run-google-java-format/master/"
+            + run_py_name
+        )
+        try:
+            urlretrieve(url, run_py_path)
+        except Exception:  # ruff:ignore[blind-except]
+            if run_py_path.exists():
+                print(
+                    "Couldn't retrieve " + run_py_name + " from " + url + "; using cached version"
+                )
+            else:
+                print("Couldn't retrieve " + run_py_name + " from " + url)
+                sys.exit(1)
+        run_py_path.chmod(run_py_path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return load_module("run_google_java_format", run_py_path)
+
+
+@functools.cache
+def load_module(name: str, path: Path) -> ModuleType:
+    """Return the Python file `path`, loaded as a module named `name`.
+
+    Returns:
+        the module.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None or spec.loader is None:
+        msg = "cannot load " + str(path)
+        raise Exception(msg)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def git_toplevel() -> Path:
+    """Return the top-level directory of the git working tree containing the current directory.
+
+    Returns:
+        the top-level directory of the git working tree.
+    """
+    return Path(
+        subprocess.check_output(["git", "rev-parse", "--show-toplevel"], text=True).rstrip("\n")
+    )
+
+
+def staged_java_files(toplevel: Path) -> list[tuple[str, str, str]]:
+    """Return the .java files that are added, copied, or modified in the git index.
+
+    Only regular files are returned.  A symbolic link or submodule whose name
+    ends in ".java" is omitted, because its blob is not Java source.
+
+    Args:
+        toplevel: the top-level directory of the git working tree
+
+    Returns:
+        a triple of (mode, object name, path) for each staged .java file.
+        The path is relative to `toplevel`.
+    """
+    # Each record is ":oldmode newmode oldobject newobject status" NUL path NUL.
+    # With --no-renames, every record has exactly one path.
+    raw = subprocess.check_output(
+        [
+            "git",
+            "diff",
+            "--cached",
+            "--raw",
+            "-z",
+            "--no-abbrev",
+            "--no-renames",
+            "--diff-filter=ACM",
+            "--",
+            "*.java",
+        ],
+        cwd=toplevel,
+    ).decode("utf-8", "surrogateescape")
+    fields = raw.split("\0")
+    result = []
+    for meta, path in zip(fields[0:-1:2], fields[1::2], strict=True):
+        _, mode, _, obj, _ = meta.split(" ")
+        if mode in regular_file_modes:
+            result.append((mode, obj, path))
+    return result
+
+
+def read_blobs(toplevel: Path, objects: list[str]) -> list[bytes]:
+    """Return the contents of the given git blobs, using a single git process.
+
+    Args:
+        toplevel: the top-level directory of the git working tree
+        objects: the object names of the blobs
+
+    Returns:
+        the contents of each blob, in order.
+    """
+    output = subprocess.run(
+        ["git", "cat-file", "--batch"],
+        cwd=toplevel,
+        input="".join(obj + "\n" for obj in objects).encode("ascii"),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    # Each blob is output as "<object> blob <size>" LF <contents> LF.
+    result = []
+    pos = 0
+    for _ in objects:
+        header_end = output.index(b"\n", pos)
+        size = int(output[pos:header_end].split()[2])
+        result.append(output[header_end + 1 : header_end + 1 + size])
+        pos = header_end + 1 + size + 1
+    return result
+
+
+def update_index(toplevel: Path, entries: list[tuple[str, str, bytes]]) -> None:
+    """Replace the staged contents of the given files, without touching the working tree.
+
+    Uses one git process to write the blobs and one to update the index.
+
+    Args:
+        toplevel: the top-level directory of the git working tree
+        entries: a triple of (mode, path, new contents) for each file.  The
+            path is relative to `toplevel`.
+    """
+    with tempfile.TemporaryDirectory(prefix="check-google-java-format-") as temp_dir:
+        temps = []
+        for i, (_, _, contents) in enumerate(entries):
+            temp = Path(temp_dir) / f"blob{i}"
+            temp.write_bytes(contents)
+            temps.append(str(temp))
+        objects = subprocess.run(
+            ["git", "hash-object", "-w", "--no-filters", "--stdin-paths"],
+            cwd=toplevel,
+            input="".join(temp + "\n" for temp in temps),
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        ).stdout.split()
+    index_info = "".join(
+        f"{mode} {obj}\t{path}\0" for (mode, path, _), obj in zip(entries, objects, strict=True)
+    )
+    subprocess.run(
+        ["git", "update-index", "-z", "--index-info"],
+        cwd=toplevel,
+        input=index_info.encode("utf-8", "surrogateescape"),
+        check=True,
+    )
+
+
+def check_staged(rgjf: ModuleType, gjf_options: list[str], fix: bool) -> int:
+    """Check the formatting of the staged version of each .java file in the git index.
+
+    Reads the blobs directly from the index, so files that are only partially
+    staged are checked correctly and the working tree is neither read nor written.
+
+    Args:
+        rgjf: the run-google-java-format.py module
+        gjf_options: extra command-line options for google-java-format
+        fix: if true, replace each improperly formatted blob in the index by
+            its reformatted version
+
+    Returns:
+        the exit status: 0 if all staged files are properly formatted (or were
+        fixed), 1 otherwise.
+    """
+    toplevel = git_toplevel()
+    staged = staged_java_files(toplevel)
+    if not staged:
+        return 0
+    blobs = read_blobs(toplevel, [obj for _, obj, _ in staged])
+    results = rgjf.format_contents(
+        [(path, blob) for (_, _, path), blob in zip(staged, blobs, strict=True)],
+        gjf_options=gjf_options,
+    )
+
+    exit_code = 0
+    fixes = []
+    for (mode, _, path), (result, formatted) in zip(staged, results, strict=True):
+        if result.status == rgjf.CHANGED:
+            if fix:
+                print("Reformatted staged version of:", path)
+                fixes.append((mode, path, formatted))
+            else:
+                print("Improper formatting:", path)
+                exit_code = 1
+        elif result.status == rgjf.ERROR:
+            print(result.message, end="", file=sys.stderr)
+            exit_code = 1
+    if fixes:
+        update_index(toplevel, fixes)
+    return exit_code
+
+
+def java_files(args: list[str]) -> list[str]:
+    """Return the given files, with each directory replaced by the .java files under it.
+
+    Returns:
+        the files named by `args`.
+    """
+    result = []
+    for arg in args:
+        if Path(arg).is_dir():
+            result += sorted(str(p) for p in Path(arg).rglob("*.java") if p.is_file())
         else:
-            print("Couldn't retrieve " + run_py_name + " from " + url)
-            sys.exit(1)
-    run_py_path.chmod(run_py_path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+            result.append(arg)
+    return result
 
-temp_dir = tempfile.mkdtemp(prefix="check-google-java-format-")
-_temp_counter = itertools.count()
 
+def changed_lines(old: bytes, new: bytes) -> int:
+    """Return the number of lines that differ between `old` and `new`.
 
-def temporary_file_name() -> str:
-    """Return the name of a temporary file, unique within this run's temp_dir.
+    A line that is replaced counts once, not twice.
 
     Returns:
-        the name of a temporary file.
+        the number of lines that differ between `old` and `new`.
     """
-    return str(Path(temp_dir) / f"tmp{next(_temp_counter)}")
+    matcher = difflib.SequenceMatcher(None, old.splitlines(), new.splitlines(), autojunk=False)
+    return sum(
+        max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"
+    )
 
 
-def cleanup() -> None:
-    """Clean up temporary files."""
-    shutil.rmtree(temp_dir)
+def print_stats(rgjf: ModuleType, files: list[str], gjf_options: list[str]) -> int:
+    """Print, per directory, how much reformatting would change the given files.
 
+    Does not modify any file.  For each directory, prints the number of files,
+    improperly formatted files, files with errors, changed lines, and fixups
+    of each kind performed by fixup-google-java-format.py.
 
-files = sys.argv[1:]
-if len(files) == 0:
-    content = sys.stdin.read()
-    fname = temporary_file_name() + ".java"
-    # Write verbatim; appending a newline (as `print` would) would make the
-    # comparison below always report improper formatting.
-    Path(fname).write_text(content)
-    files = [fname]
+    Args:
+        rgjf: the run-google-java-format.py module
+        files: the .java files
+        gjf_options: extra command-line options for google-java-format
 
-temps = []
-cmdlineargs = [f for f in files if f.startswith("-")]
-files = [f for f in files if not f.startswith("-")]
-for fname in files:
-    ftemp = temporary_file_name() + "_" + Path(fname).name
-    shutil.copyfile(fname, ftemp)
-    temps.append(ftemp)
+    Returns:
+        the exit status: 0.
+    """
+    start = time.perf_counter()
+    items = [(name, Path(name).read_bytes()) for name in files]
+    results = rgjf.format_contents(items, gjf_options=gjf_options)
+    elapsed = time.perf_counter() - start
+
+    for result, _ in results:
+        if result.status == rgjf.ERROR:
+            print(result.message, end="", file=sys.stderr)
 
-if debug:
-    print("Running " + run_py_name)
-# Problem:  if a file is syntactically illegal, this outputs the temporary file
-# name rather than the real file name.
-# Minor optimization: To save one process creation, could call directly in Python.
-result = subprocess.call([run_py_path, *cmdlineargs, *temps])
-if result != 0:
-    cleanup()
-    sys.exit(result)
+    kinds = rgjf.fixup_module().fixup_kinds
+    columns = ("files", "misformatted", "errors", "changed lines", *kinds)
+    table: dict[str, Counter[str]] = defaultdict(Counter)
+    for (name, contents), (result, formatted) in zip(items, results, strict=True):
+        for row in (str(Path(name).parent), "TOTAL"):
+            counts = table[row]
+            counts["files"] += 1
+            if result.status == rgjf.ERROR:
+                counts["errors"] += 1
+            elif result.status == rgjf.CHANGED:
+                counts["misformatted"] += 1
+                counts["changed lines"] += changed_lines(contents, formatted)
+            counts.update(result.fixups)
 
-exit_code = 0
+    rows = [*sorted(row for row in table if row != "TOTAL"), "TOTAL"]
+    width = max(len("directory"), *(len(row) for row in rows))
+    print("directory".ljust(width), *columns, sep="  ")
+    for row in rows:
+        print(
+            row.ljust(width),
+            *(str(table[row][column]).rjust(len(column)) for column in columns),
+            sep="  ",
+        )
+    cpu_seconds = sum(result.seconds for result, _ in results)
+    print(
+        f"Formatted {len(files)} files in {elapsed:.1f} seconds ({cpu_seconds:.1f} file-seconds)."
+    )
+    return 0
 
-if len(files) != len(temps):
-    raise ValueError("Length mismatch between files and temps")
 
-# "zip-without-explicit-strict" can be removed after CSE upgrades to Python 3.10.
-for file, temp in zip(files, temps):  # ruff:ignore[zip-without-explicit-strict]
-    if not filecmp.cmp(file, temp, shallow=False):
-        # TODO: gives temporary file name if reading from stdin
-        print("Improper formatting:", file)
+def fixup_changes(fixup_path: Path, files: list[str]) -> list[bool]:
+    """Return whether fixup-google-java-format.py would change each of the given files.
+
+    Args:
+        fixup_path: the fixup-google-java-format.py file
+        files: the .java files
+
+    Returns:
+        for each file, true if the fixups would change it.
+    """
+    fixup = load_module("fixup_google_java_format", fixup_path)
+    result = []
+    for name in files:
+        data = Path(name).read_bytes()
+        result.append(fixup.fixup_bytes(data) != data)
+    return result
+
+
+def check_fixup_only(rgjf: ModuleType, files: list[str]) -> tuple[int, list[Any]]:
+    """Report each file that fixup-google-java-format.py would change.
+
+    This is a fast, partial check that does not run google-java-format, so it
+    does not need Java.  A file that passes might still be reformatted by
+    google-java-format.  Large inputs are checked in parallel processes.
+
+    Args:
+        rgjf: the run-google-java-format.py module
+        files: the .java files
+
+    Returns:
+        the exit status (0 if no file would be changed, 1 otherwise), and one
+        FileResult per file.
+    """
+    # Retrieve fixup-google-java-format.py once, before starting any workers.
+    rgjf.fixup_module()
+    chunk_size = 100
+    chunks = [files[i : i + chunk_size] for i in range(0, len(files), chunk_size)]
+    jobs = min(len(chunks), os.cpu_count() or 1)
+    if jobs <= 1:
+        changes = [fixup_changes(rgjf.fixup_py_path, chunk) for chunk in chunks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            changes = list(
+                executor.map(fixup_changes, itertools.repeat(rgjf.fixup_py_path), chunks)
+            )
+
+    exit_code = 0
+    results = []
+    for chunk, chunk_changes in zip(chunks, changes, strict=True):
+        for name, changed in zip(chunk, chunk_changes, strict=True):
+            if changed:
+                print("Improper formatting:", name)
+                exit_code = 1
+            results.append(rgjf.FileResult(name, rgjf.CHANGED if changed else rgjf.UNCHANGED, 0.0))
+    return exit_code, results
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """Parse a shard specification of the form "K/N", where 1 <= K <= N.
+
+    Returns:
+        the pair (K, N).
+    """
+    try:
+        k, n = (int(part) for part in spec.split("/"))
+    except ValueError:
+        msg = f'expected K/N, got "{spec}"'
+        raise argparse.ArgumentTypeError(msg) from None
+    if not 1 <= k <= n:
+        msg = f'expected K/N with 1 <= K <= N, got "{spec}"'
+        raise argparse.ArgumentTypeError(msg)
+    return k, n
+
+
+def shard_files(files: list[str], shard: tuple[int, int]) -> list[str]:
+    """Return the files that belong to the given shard.
+
+    The files are partitioned so that each shard has about the same total size.
+    The partition depends only on the file names and sizes, so every CI node
+    that sees the same files computes the same partition, and each file is in
+    exactly one shard.
+
+    Args:
+        files: all the files
+        shard: the pair (K, N), meaning the Kth of N shards
+
+    Returns:
+        the files in the given shard, in their original order.
+    """
+    k, n = shard
+    # Largest files first; ties are broken by a hash of the name, which spreads
+    # files of the same directory among the shards.
+    weighted = sorted(
+        (-Path(name).stat().st_size, hashlib.sha256(name.encode("utf-8")).hexdigest(), name)
+        for name in set(files)
+    )
+    loads = [0] * n
+    mine = set()
+    for negated_size, _, name in weighted:
+        # The least-loaded shard; the lowest-numbered one if there is a tie.
+        target = loads.index(min(loads))
+        loads[target] += 1 - negated_size
+        if target == k - 1:
+            mine.add(name)
+    return [name for name in files if name in mine]
+
+
+def write_report(
+    report_path: str, results: list[Any], shard: tuple[int, int] | None, exit_code: int
+) -> None:
+    """Write the results of a check to a JSON file, which `merge_reports` can combine.
+
+    Args:
+        report_path: the JSON file to write
+        results: one FileResult per checked file
+        shard: the pair (K, N) if this check was the Kth of N shards, or None
+        exit_code: the exit status of this check
+    """
+    report = {
+        "shard": None if shard is None else f"{shard[0]}/{shard[1]}",
+        "exit_code": exit_code,
+        "files": [dataclasses.asdict(result) for result in results],
+    }
+    Path(report_path).write_text(json.dumps(report, indent=1) + "\n", encoding="utf-8")
+
+
+def read_report(report_path: str) -> dict[str, Any]:
+    """Read and validate a JSON report written by `write_report`.
+
+    Returns:
+        the report.
+    """
+    report = json.loads(Path(report_path).read_text(encoding="utf-8"))
+    if report["shard"] is not None:
+        parse_shard(report["shard"])
+    if not isinstance(report["exit_code"], int):
+        msg = f"exit_code is {report['exit_code']!r}"
+        raise TypeError(msg)
+    for result in report["files"]:
+        if not all(isinstance(result[key], str) for key in ("path", "status", "message")):
+            msg = f"malformed file result {result!r}"
+            raise TypeError(msg)
+    return report
+
+
+def merge_reports(rgjf: ModuleType, report_paths: list[str]) -> int:
+    """Combine JSON reports, such as from several shards, and print one verdict.
+
+    Args:
+        rgjf: the run-google-java-format.py module
+        report_paths: JSON files written by `write_report`
+
+    Returns:
+        the exit status: 0 if every report passed and, for sharded reports,
+        every shard is present; 1 otherwise.
+    """
+    exit_code = 0
+    shards = set()
+    num_shards = set()
+    files = []
+    num_reports = 0
+    for report_path in report_paths:
+        try:
+            report = read_report(report_path)
+        except (OSError, ValueError, KeyError, TypeError, argparse.ArgumentTypeError) as e:
+            print(f"{report_path}: error: not a readable report: {e}", file=sys.stderr)
+            exit_code = 1
+            continue
+        num_reports += 1
+        if report["shard"] is not None:
+            k, n = parse_shard(report["shard"])
+            if (k, n) in shards:
+                print(f"Shard {k}/{n} appears more than once, in {report_path}")
+                exit_code = 1
+            shards.add((k, n))
+            num_shards.add(n)
+        if report["exit_code"] != 0:
+            exit_code = 1
+        files += report["files"]
+
+    if len(num_shards) > 1:
+        print("Reports have different numbers of shards:", ", ".join(map(str, sorted(num_shards))))
         exit_code = 1
+    for n in num_shards:
+        missing = [str(k) for k in range(1, n + 1) if (k, n) not in shards]
+        if missing:
+            print(f"Missing report for shard(s) {', '.join(missing)} of {n}")
+            exit_code = 1
+
+    improper = 0
+    errors = 0
+    for result in files:
+        if result["status"] == rgjf.CHANGED:
+            print("Improper formatting:", result["path"])
+            improper += 1
+        elif result["status"] == rgjf.ERROR:
+            print(result["message"], end="", file=sys.stderr)
+            errors += 1
+    if improper or errors:
+        exit_code = 1
+    print(
+        f"{num_reports} reports, {len(files)} files:"
+        f" {improper} improperly formatted, {errors} with errors"
+    )
+    return exit_code
+
+
+def main() -> None:
+    """Report each file supplied on the command line that is not properly formatted."""
+    parser = argparse.ArgumentParser(
+        description="Report Java files that are not formatted by run-google-java-format.py.",
+        epilog="Other options are passed to google-java-format.",
+        allow_abbrev=False,
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="check the version of each .java file that is staged in the git index",
+    )
+    parser.add_argument(
+        "--fix-index",
+        action="store_true",
+        help="with --staged, reformat improperly formatted files in the git index",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="report, per directory, how much reformatting would change the files",
+    )
+    parser.add_argument(
+        "--fixup-only",
+        action="store_true",
+        help="only check the fixups of fixup-google-java-format.py; does not need Java",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="K/N",
+        help="check only the Kth of N nearly equal-sized, deterministic parts of the files",
+    )
+    parser.add_argument(
+        "--json",
+        metavar="FILE",
+        help="also write the results to FILE as JSON, for use with --merge",
+    )
+    parser.add_argument(
+        "--json-lines",
+        action="store_true",
+        help="print each file's result as a line of JSON, instead of as text",
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="report results in the order of the files, rather than as soon as each is known",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="instead of checking, combine the JSON reports given as arguments",
+    )
+    parser.add_argument(
+        "files", nargs="*", help="the .java files to check; a directory means all .java files in it"
+    )
+    args, extras = parser.parse_known_intermixed_args()
+    gjf_options = [a for a in extras if a.startswith("-")]
+    files = args.files + [a for a in extras if not a.startswith("-")]
+
+    if args.fix_index and not args.staged:
+        parser.error("--fix-index requires --staged")
+
+    # --shard divides a list of files; --json reports a per-file check of them.
+    for option, value in (("--shard", args.shard), ("--json", args.json)):
+        if value is None:
+            continue
+        conflicts = {"--merge": args.merge, "--staged": args.staged}
+        if option == "--json":
+            conflicts["--stats"] = args.stats
+        for conflict, is_set in conflicts.items():
+            if is_set:
+                parser.error(f"{option} cannot be used with {conflict}")
+        if not files:
+            parser.error(f"{option} requires files to check, not standard input")
+
+    # --json-lines and --ordered control how the results of a full check are printed.
+    for option, is_set in (("--json-lines", args.json_lines), ("--ordered", args.ordered)):
+        if not is_set:
+            continue
+        conflicts = {
+            "--merge": args.merge,
+            "--staged": args.staged,
+            "--fixup-only": args.fixup_only,
+            "--stats": args.stats,
+        }
+        for conflict, conflict_is_set in conflicts.items():
+            if conflict_is_set:
+                parser.error(f"{option} cannot be used with {conflict}")
+        if not files:
+            parser.error(f"{option} requires files to check, not standard input")
+
+    rgjf = run_module()
+
+    if args.merge:
+        # An empty list of reports, such as from a failed artifact download, must not pass.
+        if not files:
+            parser.error("--merge requires at least one report")
+        sys.exit(merge_reports(rgjf, files))
+
+    read_stdin = len(files) == 0
+    files = java_files(files)
+    missing = [name for name in files if not Path(name).is_file()]
+    if missing:
+        for name in missing:
+            print(f"{name}: error: file not found", file=sys.stderr)
+        sys.exit(1)
+    if args.shard is not None:
+        files = shard_files(files, args.shard)
+
+    # google-java-format raises an exception for a failure that is not about
+    # particular files, such as an invalid option.  Report it once.
+    try:
+        if args.staged:
+            sys.exit(check_staged(rgjf, gjf_options, args.fix_index))
+
+        if args.fixup_only:
+            if read_stdin:
+                data = sys.stdin.buffer.read()
+                if rgjf.fixup_bytes(data) != data:
+                    print("Improper formatting: <stdin>")
+                    sys.exit(1)
+                sys.exit(0)
+            exit_code, results = check_fixup_only(rgjf, files)
+            if args.json is not None:
+                write_report(args.json, results, args.shard, exit_code)
+            sys.exit(exit_code)
+
+        if args.stats:
+            sys.exit(print_stats(rgjf, files, gjf_options))
+
+        if read_stdin and not args.staged:
+            content = sys.stdin.read()
+            formatted = rgjf.format_source(content, gjf_options)
+            if formatted != content:
+                print("Improper formatting: <stdin>")
+                sys.exit(1)
+            sys.exit(0)
+
+        if debug:
+            print("Running " + run_py_name)
+        exit_code = 0
+        results = []
+        # Report each result as soon as it is known, so that a long check shows progress.
+        for result in rgjf.iter_format_files(
+            files, check_only=True, gjf_options=gjf_options, ordered=args.ordered
+        ):
+            results.append(result)
+            if result.status != rgjf.UNCHANGED:
+                exit_code = 1
+            if args.json_lines:
+                print(json.dumps(dataclasses.asdict(result)), flush=True)
+            elif result.status == rgjf.CHANGED:
+                print("Improper formatting:", result.path, flush=True)
+            elif result.status == rgjf.ERROR:
+                print(result.message, end="", file=sys.stderr, flush=True)
+        if args.json is not None:
+            write_report(args.json, results, args.shard, exit_code)
+
+        sys.exit(exit_code)
+
+    except Exception as e:  # ruff:ignore[blind-except]
+        print(str(e).rstrip("\n"), file=sys.stderr)
+        sys.exit(1)
 
-cleanup()
 
-sys.exit(exit_code)
+if __name__ == "__main__":
+    main()
@@ -12,10 +12,13 @@ You typically will not run this program directly; it is run by
 run-google-java-format.py.
 """
 
+import io
 import pathlib
 import re
 import sys
-from typing import Any, TextIO
+from collections import Counter
+from collections.abc import Iterable
+from typing import Any, BinaryIO
 
 # pylint: disable=line-too-long, multiple-statements
 
@@ -406,9 +409,9 @@ def debug_print(*args: object, **kwargs: Any) -> None:
 
 # Two annotations in a row, or an annotation abutting array brackets "[]".
 # Space is inserted between.
-abuttinganno_regex = re.compile(r"(/\*@[A-Za-z0-9_]+\*/)(\[\]|/\*@[A-Za-z0-9_]+\*/)")
+abuttinganno_regex = re.compile(rb"(/\*@[A-Za-z0-9_]+\*/)(\[\]|/\*@[A-Za-z0-9_]+\*/)")
 # Voodoo annotation with extra space after
-voodootrailingspace_regex = re.compile(r"(/\*>>> ?@.*\bthis\*/) (\))")
+voodootrailingspace_regex = re.compile(rb"(/\*>>> ?@.*\bthis\*/) (\))")
 
 # Matches the argument to an annotation.
 # 3 cases:
@@ -417,9 +420,9 @@ voodootrailingspace_regex = re.compile(r"(/\*>>> ?@.*\bthis\*/) (\))")
 #   (.*)
 # The regex tries to safely permit "()" within a string in an annotation, such as
 #   @GuardedBy("c1.getFieldPure2()")
-annoarg_regex = r'(?: *(?:\( *\)|\( *"[^"]*" *\)|\([^")][^)]*\)))?'
+annoarg_regex = rb'(?: *(?:\( *\)|\( *"[^"]*" *\)|\([^")][^)]*\)))?'
 # Matches an annotation
-anno_regex = r"@[A-Za-z0-9_.]+" + annoarg_regex
+anno_regex = rb"@[A-Za-z0-9_.]+" + annoarg_regex
 
 # Matches, at the end of its line (in capturing group 2):
 #  * An annotation
@@ -432,21 +435,24 @@ anno_regex = r"@[A-Za-z0-9_.]+" + annoarg_regex
 #    https://github.com/google/google-java-format/commit/ca0c4d90cdbb46b3a2bf9c2b83d0bd558cccc41e )
 # The annotation will be moved to the beginning of the following line,
 # if it appears in type_annotations.
+# Lines keep their line terminators, so "\r?$" also matches at the end of a CRLF line.
 trailinganno_regex = re.compile(
-    r"^(.*?)[ \t]*(" + anno_regex + r"|/\*" + anno_regex + r"\*/|/\* *[A-Za-z0-9_]+ *= *\*/)$"
+    rb"^(.*?)[ \t]*(" + anno_regex + rb"|/\*" + anno_regex + rb"\*/|/\* *[A-Za-z0-9_]+ *= *\*/)\r?$"
 )
 
-whitespace_regex = re.compile(r"^([ \t]*).*$")
+whitespace_regex = re.compile(rb"^([ \t]*).*$")
 
-emptyline_regex = re.compile(r"^[ \t]*$")
+emptyline_regex = re.compile(rb"^[ \t]*\r?$")
+
+try_regex = re.compile(rb" try \(\r?$")
 
 # Heuristic: matches if the line might be within a //, /*, or Javadoc comment.
-within_comment_regex = re.compile(r"//|/\*(?!.*\/*/)|^[ \t]*\*[ \t]")
+within_comment_regex = re.compile(rb"//|/\*(?!.*\/*/)|^[ \t]*\*[ \t]")
 
-starts_with_comment_regex = re.compile(r"^[ \t]*(//|/\*$|/\*[^@]|\*|void\b)")
+starts_with_comment_regex = re.compile(rb"^[ \t]*(//|/\*\r?$|/\*[^@]|\*|void\b)")
 
 
-def insert_after_whitespace(insertion: str, s: str) -> str:
+def insert_after_whitespace(insertion: bytes, s: bytes) -> bytes:
     """Return s, with insertion inserted after its leading whitespace.
 
     Returns:
@@ -458,22 +464,40 @@ def insert_after_whitespace(insertion: str, s: str) -> str:
     return s[0 : m.end(1)] + insertion + s[m.end(1) :]
 
 
-def fixup_loop(infile: TextIO, outfile: TextIO) -> None:
+# The kinds of fixups that fixup_loop performs, as counted by its `counts` argument.
+TRAILING_ANNOTATION = "trailing annotation"
+ABUTTING_ANNOTATIONS = "abutting annotations"
+VOODOO_TRAILING_SPACE = "voodoo trailing space"
+TRY_JOIN = "try join"
+fixup_kinds = (TRAILING_ANNOTATION, ABUTTING_ANNOTATIONS, VOODOO_TRAILING_SPACE, TRY_JOIN)
+
+
+def fixup_loop(
+    infile: Iterable[bytes], outfile: BinaryIO, counts: Counter[str] | None = None
+) -> None:
     """Fix up formatting while reading from infile and writing to outfile.
 
+    The lines are bytes, each with its line terminator, so the output is
+    byte-for-byte identical to the input except for the fixups.
+
     Args:
-        infile: the input file
+        infile: the input lines
         outfile: the output file
+        counts: if non-None, incremented by the number of fixups of each kind
     """
-    prev = ""  # previous line, which might end with a type annotation.
+    if counts is None:
+        counts = Counter()
+    prev = b""  # previous line, which might end with a type annotation.
     for line in infile:
         # Handle trailing space after a voodoo comment
-        line = voodootrailingspace_regex.sub(r"\1\2", line)
+        line, n = voodootrailingspace_regex.subn(rb"\1\2", line)
+        counts[VOODOO_TRAILING_SPACE] += n
         # Handle abutting annotations in comments
         m = re.search(abuttinganno_regex, line)
         while m:
             debug_print("found abutting", line)
-            line = line[0 : m.end(1)] + " " + line[m.start(2) :]
+            counts[ABUTTING_ANNOTATIONS] += 1
+            line = line[0 : m.end(1)] + b" " + line[m.start(2) :]
             m = re.search(abuttinganno_regex, line)
         # Don't move an annotation to the start of a comment line
         if re.search(starts_with_comment_regex, line):
@@ -487,7 +511,7 @@ def fixup_loop(infile: TextIO, outfile: TextIO) -> None:
         while m:
             debug_print("found trailing", prev, line)
             anno = m.group(2)
-            if base_annotation(anno) not in type_annotations:
+            if base_annotation(anno.decode("utf-8", "replace")) not in type_annotations:
                 break
             debug_print("prev was:", prev)
             candidate_prev = prev[0 : m.end(1)] + prev[m.end(2) :]
@@ -498,18 +522,21 @@ def fixup_loop(infile: TextIO, outfile: TextIO) -> None:
             prev = candidate_prev
             debug_print("prev is:", prev)
             if re.search(emptyline_regex, prev):
-                prev = ""
+                prev = b""
                 debug_print("prev is empty")
             debug_print("line was:", line)
-            line = insert_after_whitespace(anno + " ", line)
+            line = insert_after_whitespace(anno + b" ", line)
+            counts[TRAILING_ANNOTATION] += 1
             debug_print("line is :", line)
             m = re.search(trailinganno_regex, prev)
             debug_print("trailing? (post-loop-body)", m, prev, line)
-            if re.search(r" try \($", prev):
+            if re.search(try_regex, prev):
                 candidate_line = prev.rstrip() + line.lstrip()
-                if len(candidate_line) < 100:
+                # Measure in characters, not counting a CR before the newline.
+                if len(candidate_line.decode("utf-8", "replace").replace("\r", "")) < 100:
                     line = candidate_line
-                    prev = ""
+                    prev = b""
+                    counts[TRY_JOIN] += 1
                 debug_print("joined, now line is:", line)
             else:
                 debug_print("no try match for", prev, line)
@@ -548,11 +575,34 @@ def base_annotation(annotation: str) -> str:
     return annotation
 
 
-if len(sys.argv) == 1:
-    fixup_loop(sys.stdin, sys.stdout)
-else:
-    for fname in sys.argv[1:]:
-        outfname = fname + ".out"
-        with pathlib.Path(fname).open("r") as infile, pathlib.Path(outfname).open("w") as outfile:
-            fixup_loop(infile, outfile)
-        pathlib.Path(outfname).rename(fname)
+def fixup_bytes(data: bytes, counts: Counter[str] | None = None) -> bytes:
+    """Return `data` with its formatting fixed up.
+
+    Args:
+        data: the contents of a .java file
+        counts: if non-None, incremented by the number of fixups of each kind
+
+    Returns:
+        `data` with its formatting fixed up.
+    """
+    outfile = io.BytesIO()
+    fixup_loop(data.splitlines(keepends=True), outfile, counts)
+    return outfile.getvalue()
+
+
+def main() -> None:
+    """Fix up each file supplied on the command line, or standard input."""
+    if len(sys.argv) == 1:
+        sys.stdout.buffer.write(fixup_bytes(sys.stdin.buffer.read()))
+    else:
+        for fname in sys.argv[1:]:
+            data = pathlib.Path(fname).read_bytes()
+            fixed = fixup_bytes(data)
+            if fixed != data:
+                outfname = fname + ".out"
+                pathlib.Path(outfname).write_bytes(fixed)
+                pathlib.Path(outfname).rename(fname)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,41 @@ Yields the Google Java style (by calling out to the google-java-format
 program, https://github.com/google/google-java-format), but with
 improvements to the formatting of type annotations and annotations in
 comments.
+
+This file can also be used as a library.  Importing it does no work and it
+keeps no mutable global state, so its functions may be called concurrently
+from multiple threads.  The main entry points are `format_files()`,
+`iter_format_files()`, and `format_source()`.  Because the file name contains
+hyphens, load it with importlib, as check-google-java-format.py does.
 """
 
+import concurrent.futures
+import contextlib
+import dataclasses
+import functools
+import hashlib
+import http.client
+import importlib.util
+import json
+import math
 import os
+import platform
 import re
+import shlex
 import shutil
 import stat
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
 from pathlib import Path
+from types import ModuleType
+from typing import Any
 
 try:
     from urllib import urlopen  # ty: ignore[unresolved-import]
@@ -25,25 +50,69 @@ debug = False
 # debug = True
 
 script_dir = Path(__file__).resolve().parent
-# Rather than calling out to the shell, it would be better to
-# call directly in Python.
 fixup_py_name = "fixup-google-java-format.py"
 fixup_py_path = script_dir / fixup_py_name
 
-# java_version_string is either 1.8 or nothing.
-# For JDK  8, `java -version` has the form: openjdk version "1.8.0_292"
-# For JDK 11, `java -version` has the form: openjdk 11.0.11 2021-04-20
-# For JDK 17, `java -version` has the form: java 17 2021-09-14 LTS
-java_version_string = subprocess.check_output(
-    ["java", "-version"], stderr=subprocess.STDOUT
-).decode("utf-8")
-if debug:
-    print("java_version_string =", java_version_string)
-match = re.search(r'"(\d+(\.\d+)?).*"', java_version_string)
-if not match:
-    msg = f'no match for java version string "{java_version_string}"'
-    raise Exception(msg)
-java_version = match.groups()[0]
+# Possible values for `FileResult.status`.
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+ERROR = "error"
+
+# Serializes downloads and module loading among threads.
+_setup_lock = threading.Lock()
+# Held by the thread that is creating a class-data-sharing archive.
+_cds_lock = threading.Lock()
+# The number of concurrent requests to the result cache.
+_cache_threads = 8
+# The first word of each result-cache value; change it when the format of values changes.
+_cache_format = b"run-google-java-format-cache-2"
+
+# Parameters for sizing runs; see `plan_run()`.
+_mib = 1024 * 1024
+# Memory used by each JVM outside its heap: metaspace, code cache, thread stacks.
+_jvm_overhead = 128 * _mib
+_min_heap = 256 * _mib
+# Heap needed, per file being formatted concurrently, per byte of that file.
+_heap_per_source_byte = 64
+# A JVM whose input is smaller than this finishes before the optimizing compiler pays off.
+_short_run_bytes = 2 * _mib
+# By default, each job formats several batches, so that the first results are
+# available early and the last batches even out the load.  Batch sizes are kept
+# within bounds, so that JVM startup does not dominate and results keep coming.
+_batches_per_job = 4
+_min_files_per_job = 16
+_max_files_per_job = 250
+
+
+@functools.cache
+def java_version_string() -> str:
+    """Return the output of `java -version`.
+
+    Returns:
+        the output of `java -version`.
+    """
+    # For JDK  8, `java -version` has the form: openjdk version "1.8.0_292"
+    # For JDK 11, `java -version` has the form: openjdk 11.0.11 2021-04-20
+    # For JDK 17, `java -version` has the form: java 17 2021-09-14 LTS
+    result = subprocess.check_output(["java", "-version"], stderr=subprocess.STDOUT).decode("utf-8")
+    if debug:
+        print("java_version_string =", result)
+    return result
+
+
+def java_version() -> str:
+    """Return the version of the `java` executable, such as "1.8" or "17".
+
+    Returns:
+        the version of the `java` executable.
+    """
+    version_string = java_version_string()
+    match = re.search(r'"(\d+(\.\d+)?).*"', version_string)
+    if not match:
+        msg = f'no match for java version string "{version_string}"'
+        raise Exception(msg)
+    return match.groups()[0]
+
 
 ## To use an officially released version.
 ## (Releases appear at https://github.com/google/google-java-format/releases/ ,
@@ -58,36 +127,74 @@ java_version = match.groups()[0]
 ## To set this variable:
 ## https://github.com/diffplug/spotless/blob/3924217d5f711a9fa41dcb71810f6e3649328135/lib/src/main/java/com/diffplug/spotless/java/GoogleJavaFormatStep.java#L122
 ## or search for "Bump default google" in https://github.com/diffplug/spotless/blob/main/plugin-gradle/CHANGES.md
-if java_version == "1.8":
-    gjf_version_default = "1.7"
-elif java_version == "11":
-    gjf_version_default = "1.24.0"
-elif java_version == "17":
-    gjf_version_default = "1.28.0"
-elif java_version == "21":
-    gjf_version_default = "1.29.0"
-else:
-    gjf_version_default = "1.36.1"
-gjf_version = os.getenv("GJF_VERSION", gjf_version_default)
-gjf_download_prefix = "v" if re.match(r"^1\.[1-9][0-9]", gjf_version) else "google-java-format-"
-gjf_snapshot = os.getenv("GJF_SNAPSHOT", "")
-gjf_url_base = os.getenv(
-    "GJF_URL_BASE",
-    "https://github.com/google/google-java-format/releases/download/"
-    + gjf_download_prefix
-    + gjf_version
-    + "/",
-)
+def gjf_version_default() -> str:
+    """Return the default version of google-java-format for the installed JDK.
+
+    Returns:
+        the default version of google-java-format.
+    """
+    # Without Java, only the native executable can be used; it can be the latest version.
+    version = java_version() if shutil.which("java") else None
+    if version == "1.8":
+        return "1.7"
+    if version == "11":
+        return "1.24.0"
+    if version == "17":
+        return "1.28.0"
+    if version == "21":
+        return "1.29.0"
+    return "1.36.1"
+
+
+def gjf_version() -> str:
+    """Return the version of google-java-format to use.
+
+    Returns:
+        the value of environment variable GJF_VERSION, or a default.
+    """
+    return os.getenv("GJF_VERSION") or gjf_version_default()
+
+
 ## To use a non-official version by default, because an official version is
-## unusably buggy (like 1.1) or no new release has been made in a long time.
+## unusably buggy (like 1.1) or no new release has been made in a long time,
+## set environment variables GJF_VERSION, GJF_SNAPSHOT, and GJF_URL_BASE.
 ## Never change the file at a URL; make it unique by adding a date.
-# gjf_version = "1.5"
-# gjf_snapshot = "-SNAPSHOT-20171012"
-# gjf_url_base = "http://types.cs.washington.edu/"
-# gjf_url_base = "http://homes.cs.washington.edu/~mernst/tmp2/"
+# GJF_VERSION=1.5
+# GJF_SNAPSHOT=-SNAPSHOT-20171012
+# GJF_URL_BASE=http://types.cs.washington.edu/
+def gjf_url_base() -> str:
+    """Return the URL of the directory from which to download google-java-format.
+
+    Returns:
+        the URL of the directory from which to download google-java-format.
+    """
+    version = gjf_version()
+    gjf_download_prefix = "v" if re.match(r"^1\.[1-9][0-9]", version) else "google-java-format-"
+    return os.getenv(
+        "GJF_URL_BASE",
+        "https://github.com/google/google-java-format/releases/download/"
+        + gjf_download_prefix
+        + version
+        + "/",
+    )
+
+
+def gjf_jar_name() -> str:
+    """Return the file name of the google-java-format jar file.
+
+    Returns:
+        the file name of the google-java-format jar file.
+    """
+    return "google-java-format-" + gjf_version() + os.getenv("GJF_SNAPSHOT", "") + "-all-deps.jar"
 
-gjf_jar_name = "google-java-format-" + gjf_version + gjf_snapshot + "-all-deps.jar"
-gjf_url = gjf_url_base + gjf_jar_name
+
+def gjf_url() -> str:
+    """Return the URL from which to download the google-java-format jar file.
+
+    Returns:
+        the URL from which to download the google-java-format jar file.
+    """
+    return gjf_url_base() + gjf_jar_name()
 
 
 # For some reason, the "git ls-files" must be run from the root.
@@ -141,59 +248,208 @@ def urlretrieve(url: str, filename: Path) -> None:
     tmp_path.rename(filename)
 
 
-# Set gjf_jar_path, or retrieve it if it doesn't appear locally. Does not update
-# from remote path if remote is newer, so never change files on the server.
-candidate1 = script_dir / gjf_jar_name
-candidate2 = script_dir.parent / "lib" / gjf_jar_name
-if candidate1.is_file():
-    gjf_jar_path = candidate1
-elif candidate2.is_file():
-    gjf_jar_path = candidate2
-else:
-    gjf_jar_path = candidate1
-    # print("retrieving " + gjf_url + " to " + gjf_jar_path)
-    # urlretrieve downloads atomically (temp file plus rename), which avoids
-    # races with other concurrent run-google-java-format processes.
-    try:
-        urlretrieve(gjf_url, gjf_jar_path)
-    except Exception as e:
-        raise Exception("Problem while retrieving " + gjf_url + " to " + str(gjf_jar_path)) from e
+def _store_candidates(name: str) -> list[Path]:
+    """Return the places where a downloaded file named `name` may be stored.
 
+    Returns:
+        the places where a downloaded file named `name` may be stored, in order of preference.
+    """
+    return [script_dir / name, script_dir.parent / "lib" / name]
+
+
+def _stored_file(name: str) -> Path | None:
+    """Return the downloaded file named `name`, or None if it has not been downloaded.
 
-# Don't replace local with remote if local is under version control.
-# It would be better to just test whether the remote is newer than local,
-# but raw GitHub URLs don't have the necessary last-modified information.
-if not under_git(script_dir, fixup_py_name):
-    url = (
-        "https://raw.githubusercontent.com/plume-lib/run-google-java-format/master/" + fixup_py_name
+    Returns:
+        the downloaded file named `name`, or None.
+    """
+    for candidate in _store_candidates(name):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def _retrieve_to_store(name: str, url: str, verify: Callable[[Path], None] | None = None) -> Path:
+    """Return the downloaded file named `name`, retrieving it from `url` if necessary.
+
+    Does not update from remote path if remote is newer, so never change files
+    on the server.
+
+    Args:
+        name: the file name
+        url: the URL from which to retrieve the file
+        verify: if non-None, called on a newly-retrieved file before it is put
+            in place; raises an exception if the file is not usable
+
+    Returns:
+        the downloaded file.
+    """
+    result = _stored_file(name)
+    if result is not None:
+        return result
+    with _setup_lock:
+        result = _stored_file(name)
+        if result is not None:
+            return result
+        result = _store_candidates(name)[0]
+        # print("retrieving " + url + " to " + result)
+        # Retrieve to a temporary name and rename it into place, which avoids
+        # races with other concurrent run-google-java-format processes.
+        downloading = result.with_name(f"{name}.{os.getpid()}.tmp")
+        try:
+            urlretrieve(url, downloading)
+            if verify is not None:
+                verify(downloading)
+        except Exception as e:
+            downloading.unlink(missing_ok=True)
+            raise Exception("Problem while retrieving " + url + " to " + str(result)) from e
+        downloading.replace(result)
+    return result
+
+
+def gjf_jar_path() -> Path:
+    """Return the google-java-format jar file, retrieving it if it doesn't appear locally.
+
+    Returns:
+        the google-java-format jar file.
+    """
+    return _retrieve_to_store(gjf_jar_name(), gjf_url())
+
+
+def gjf_native_platform() -> str | None:
+    """Return the platform name of google-java-format's native executable for this machine.
+
+    Returns:
+        the platform name, such as "linux-x86-64", or None if google-java-format
+        does not publish a native executable for this machine.
+    """
+    machine = platform.machine().lower()
+    arch = {"x86_64": "x86-64", "amd64": "x86-64", "aarch64": "arm64", "arm64": "arm64"}.get(
+        machine
     )
-    try:
-        urlretrieve(url, fixup_py_path)
-    except Exception:  # ruff:ignore[blind-except]
-        if fixup_py_path.exists():
-            print("Couldn't retrieve " + fixup_py_name + " from " + url + "; using cached version")
-        else:
-            print("Couldn't retrieve " + fixup_py_name + " from " + url)
-            sys.exit(1)
-    fixup_py_path.chmod(fixup_py_path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
-
-if debug:
-    print("script_dir:", script_dir)
-    print("fixup_py_path: ", fixup_py_path)
-    print("gjf_jar_path: ", gjf_jar_path)
-
-files = sys.argv[1:]
-if len(files) == 0:
-    print("run-google-java-format.py expects 1 or more filenames as arguments")
-    sys.exit(1)
-
-if java_version == "1.8":
-    jdk_opens = []
-else:
+    if sys.platform.startswith("linux") and arch is not None:
+        return "linux-" + arch
+    if sys.platform == "darwin" and arch == "arm64":
+        return "darwin-arm64"
+    if sys.platform == "win32" and arch == "x86-64":
+        return "windows-x86-64"
+    return None
+
+
+def gjf_native_asset_name() -> str:
+    """Return the name under which google-java-format's native executable is published.
+
+    Returns:
+        the name of the native executable in a google-java-format release.
+    """
+    platform_name = gjf_native_platform()
+    if platform_name is None:
+        msg = "google-java-format has no native executable for this platform"
+        raise Exception(msg)
+    suffix = ".exe" if platform_name.startswith("windows") else ""
+    return "google-java-format_" + platform_name + suffix
+
+
+def gjf_native_name() -> str:
+    """Return the local file name of google-java-format's native executable.
+
+    Unlike the published name, it includes the version, like the jar file name does.
+
+    Returns:
+        the local file name of google-java-format's native executable.
+    """
+    return gjf_native_asset_name().replace(
+        "google-java-format_",
+        "google-java-format-" + gjf_version() + os.getenv("GJF_SNAPSHOT", "") + "_",
+    )
+
+
+def _verify_native(executable: Path) -> None:
+    """Make `executable` executable, and check that it is the expected google-java-format version.
+
+    Args:
+        executable: a newly-retrieved google-java-format native executable
+    """
+    executable.chmod(executable.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    proc = subprocess.run(
+        [str(executable), "--version"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        check=False,
+    )
+    output = proc.stdout.decode("utf-8", "replace")
+    if proc.returncode != 0 or gjf_version() not in output:
+        msg = f"expected google-java-format version {gjf_version()}, got: {output}"
+        raise Exception(msg)
+
+
+def gjf_native_path() -> Path:
+    """Return google-java-format's native executable, retrieving it if it doesn't appear locally.
+
+    Returns:
+        google-java-format's native executable.
+    """
+    return _retrieve_to_store(
+        gjf_native_name(), gjf_url_base() + gjf_native_asset_name(), _verify_native
+    )
+
+
+@functools.cache
+def fixup_module() -> ModuleType:
+    """Return fixup-google-java-format.py, loaded as a module.
+
+    Retrieves the latest version first, unless the local copy is under version control.
+
+    Returns:
+        the fixup-google-java-format.py module.
+    """
+    with _setup_lock:
+        # Don't replace local with remote if local is under version control.
+        # It would be better to just test whether the remote is newer than local,
+        # but raw GitHub URLs don't have the necessary last-modified information.
+        if not under_git(script_dir, fixup_py_name):
+            url = (
+                "https://raw.githubusercontent.com/plume-lib/run-google-java-format/master/"
+                + fixup_py_name
+            )
+            try:
+                urlretrieve(url, fixup_py_path)
+            except Exception as e:
+                if not fixup_py_path.exists():
+                    msg = "Couldn't retrieve " + fixup_py_name + " from " + url
+                    raise Exception(msg) from e
+                print(
+                    "Couldn't retrieve " + fixup_py_name + " from " + url + "; using cached version"
+                )
+            fixup_py_path.chmod(
+                fixup_py_path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+            )
+
+        if debug:
+            print("script_dir:", script_dir)
+            print("fixup_py_path: ", fixup_py_path)
+
+        spec = importlib.util.spec_from_file_location("fixup_google_java_format", fixup_py_path)
+        if spec is None or spec.loader is None:
+            msg = "cannot load " + str(fixup_py_path)
+            raise Exception(msg)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+def jdk_opens() -> list[str]:
+    """Return the JVM options that google-java-format needs on this JDK.
+
+    Returns:
+        the JVM options that google-java-format needs on this JDK.
+    """
+    if java_version() == "1.8":
+        return []
     # From https://github.com/google/google-java-format/releases/
     # This is no longer required as of GJF version 1.15.0, but users might
     # supply a version number lower than that.
-    jdk_opens = [
+    return [
         "--add-exports",
         "jdk.compiler/com.sun.tools.javac.api=ALL-UNNAMED",
         "--add-exports",
@@ -206,24 +462,952 @@ else:
         "jdk.compiler/com.sun.tools.javac.util=ALL-UNNAMED",
     ]
 
-result = subprocess.call(["java", *jdk_opens, "-jar", str(gjf_jar_path), "--replace", *files])
-
-## This if statement used to be commented out, because google-java-format
-## crashed a lot.  It seems more stable now.
-# Don't stop if there was an error, because google-java-format won't munge
-# files and we still want to run fixup-google-java-format.py.
-if result != 0:
-    print("Error", result, "when running google-java-format")
-    sys.exit(result)
-
-files = [f for f in files if not f.startswith("-")]
-# Exit if no files were supplied (maybe "--help" was supplied)
-if not files:
-    sys.exit(0)
-
-if debug:
-    print("Running " + fixup_py_name)
-result = subprocess.call([fixup_py_path, *files])
-if result != 0:
-    print("Error", result, "when running " + fixup_py_name)
-    sys.exit(result)
+
+def java_major_version() -> int:
+    """Return the major version of the `java` executable, such as 8 or 17.
+
+    Returns:
+        the major version of the `java` executable.
+    """
+    parts = java_version().split(".")
+    return int(parts[1]) if parts[0] == "1" else int(parts[0])
+
+
+def cds_archive_path() -> Path:
+    """Return the class-data-sharing archive for the current JDK and google-java-format jar.
+
+    The archive lives next to the jar file.  Its name includes a hash of the
+    JDK's location and full version, so a different JDK uses a different archive.
+
+    Returns:
+        the class-data-sharing archive for the current JDK and google-java-format jar.
+    """
+    jar = gjf_jar_path()
+    java = Path(shutil.which("java") or "java").resolve()
+    jdk_key = str(java) + "\n" + java_version_string()
+    digest = hashlib.sha256(jdk_key.encode("utf-8")).hexdigest()[:16]
+    return jar.with_name(f"{jar.stem}-{digest}.jsa")
+
+
+def _run_jar(
+    args: Sequence[str], jvm_options: Sequence[str] = (), **kwargs: Any
+) -> subprocess.CompletedProcess[bytes]:
+    """Run google-java-format's jar file with the given arguments.
+
+    If environment variable GJF_CDS is set (to a non-empty value) and the JDK is
+    version 13 or later, uses a class-data-sharing (AppCDS) archive to reduce
+    JVM startup time.  The archive is created by the first run that does not
+    find a valid one, and is re-created if the jar file is newer than it.
+
+    Args:
+        args: the arguments to google-java-format
+        jvm_options: options for the JVM, such as a heap limit
+        **kwargs: passed to subprocess.run
+
+    Returns:
+        the completed google-java-format process.
+    """
+    jar = gjf_jar_path()
+    cds_options = []
+    archive = None
+    creating = None
+    if os.getenv("GJF_CDS") and java_major_version() >= 13:
+        archive = cds_archive_path()
+        # Archive diagnostics would be mistaken for google-java-format output.
+        cds_options = ["-Xshare:auto", "-Xlog:cds*=off", "-Xlog:class+path*=off"]
+        if archive.is_file() and archive.stat().st_mtime >= jar.stat().st_mtime:
+            cds_options.append(f"-XX:SharedArchiveFile={archive}")
+        elif _cds_lock.acquire(blocking=False):
+            # Dump to a temporary file, then rename it into place, so that a
+            # concurrent process never uses a partially-written archive.
+            creating = archive.with_name(f"{archive.name}.{os.getpid()}.tmp")
+            cds_options.append(f"-XX:ArchiveClassesAtExit={creating}")
+    try:
+        return subprocess.run(
+            ["java", *jdk_opens(), *jvm_options, *cds_options, "-jar", str(jar), *args],
+            check=False,
+            **kwargs,
+        )
+    finally:
+        if creating is not None and archive is not None:
+            try:
+                if creating.is_file():
+                    creating.replace(archive)
+            finally:
+                _cds_lock.release()
+
+
+def _run_native(
+    args: Sequence[str],
+    jvm_options: Sequence[str] = (),  # ruff:ignore[unused-function-argument]
+    **kwargs: Any,
+) -> subprocess.CompletedProcess[bytes]:
+    """Run google-java-format's native executable with the given arguments.
+
+    The native executable starts much faster than the JVM, and does not need Java.
+
+    Args:
+        args: the arguments to google-java-format
+        jvm_options: ignored, because the native executable does not run on the JVM
+        **kwargs: passed to subprocess.run
+
+    Returns:
+        the completed google-java-format process.
+    """
+    return subprocess.run([str(gjf_native_path()), *args], check=False, **kwargs)
+
+
+# Maps each backend name to a function that runs google-java-format that way.
+# Each takes the same arguments as `run_gjf`.
+_backends: dict[str, Callable[..., subprocess.CompletedProcess[bytes]]] = {
+    "jar": _run_jar,
+    "native": _run_native,
+}
+
+
+def gjf_backend() -> str:
+    """Return the name of the way to run google-java-format: "jar" or "native".
+
+    Environment variable GJF_BACKEND selects the backend.  If it is unset or
+    "auto", the native executable is used if it has already been retrieved,
+    or if there is no `java` executable; otherwise the jar file is used.
+
+    Returns:
+        the name of the backend.
+    """
+    backend = os.getenv("GJF_BACKEND") or "auto"
+    if backend != "auto":
+        if backend not in _backends:
+            msg = f'GJF_BACKEND is "{backend}"; expected one of: auto, {", ".join(_backends)}'
+            raise Exception(msg)
+        return backend
+    if gjf_native_platform() is not None and (
+        not shutil.which("java") or _stored_file(gjf_native_name()) is not None
+    ):
+        return "native"
+    return "jar"
+
+
+def run_gjf(
+    args: Sequence[str], jvm_options: Sequence[str] = (), **kwargs: Any
+) -> subprocess.CompletedProcess[bytes]:
+    """Run google-java-format with the given arguments, using the backend from `gjf_backend()`.
+
+    Args:
+        args: the arguments to google-java-format
+        jvm_options: options for the JVM, such as `RunPlan.jvm_options`; ignored
+            by the native backend
+        **kwargs: passed to subprocess.run
+
+    Returns:
+        the completed google-java-format process.
+    """
+    return _backends[gjf_backend()](args, jvm_options, **kwargs)
+
+
+@dataclasses.dataclass(frozen=True)
+class FileResult:
+    """The outcome of formatting, or checking the formatting of, one file.
+
+    Attributes:
+        path: the file name, as supplied by the caller
+        status: CHANGED, UNCHANGED, or ERROR
+        seconds: wall-clock time spent on the file.  The google-java-format
+            process is shared by a batch of files, and its time is divided
+            equally among them.
+        message: for an ERROR, the diagnostic output
+        fixups: the number of fixups of each kind performed by
+            fixup-google-java-format.py, such as "trailing annotation"
+    """
+
+    path: str
+    status: str
+    seconds: float
+    message: str = ""
+    fixups: Mapping[str, int] = dataclasses.field(default_factory=dict)
+
+
+def fixup_bytes(data: bytes, counts: Counter[str] | None = None) -> bytes:
+    """Return `data` after the fixups of fixup-google-java-format.py.
+
+    Args:
+        data: the contents of a .java file
+        counts: if non-None, incremented by the number of fixups of each kind
+
+    Returns:
+        `data` after the fixups of fixup-google-java-format.py.
+    """
+    return fixup_module().fixup_bytes(data, counts)
+
+
+def fixup_text(text: str, counts: Counter[str] | None = None) -> str:
+    """Return `text` after the fixups of fixup-google-java-format.py.
+
+    Args:
+        text: the contents of a .java file
+        counts: if non-None, incremented by the number of fixups of each kind
+
+    Returns:
+        `text` after the fixups of fixup-google-java-format.py.
+    """
+    data = text.encode("utf-8", "surrogateescape")
+    return fixup_bytes(data, counts).decode("utf-8", "surrogateescape")
+
+
+def format_source(text: str, gjf_options: Sequence[str] = ()) -> str:
+    """Return `text`, a Java compilation unit, reformatted.
+
+    Runs google-java-format on standard input, so it creates no files.
+
+    Args:
+        text: the contents of a .java file
+        gjf_options: extra command-line options for google-java-format
+
+    Returns:
+        the reformatted text.
+    """
+    data = text.encode("utf-8")
+    proc = run_gjf(
+        [*gjf_options, "-"],
+        plan_run([len(data)]).jvm_options,
+        input=data,
+        capture_output=True,
+    )
+    if proc.returncode != 0:
+        msg = f"Error {proc.returncode} when running google-java-format: " + proc.stderr.decode(
+            "utf-8", "replace"
+        )
+        raise Exception(msg)
+    return fixup_bytes(proc.stdout).decode("utf-8", "surrogateescape")
+
+
+def _attribute_errors(stderr: str, temps: Sequence[Path], names: Sequence[str]) -> dict[int, str]:
+    """Split google-java-format's diagnostics among the files that they are about.
+
+    google-java-format reports each error as "<file>:<line>:<column>: error: ...",
+    and keeps going with the remaining files.  In the messages, each temporary
+    file name is replaced by the original one.
+
+    Args:
+        stderr: google-java-format's error output
+        temps: the temporary files that google-java-format processed
+        names: the original file name of each temporary file
+
+    Returns:
+        a map from the index of each file with errors to its error messages.
+        Lines that are not about any file, such as JVM warnings, are omitted.
+    """
+    prefixes = [str(temp) + ":" for temp in temps]
+    errors: dict[int, str] = {}
+    for line in stderr.splitlines(keepends=True):
+        # A file name may contain ":", as in "C:\\...", so match whole prefixes.
+        # If several match, the longest one is the file that the line is about.
+        matches = [i for i, prefix in enumerate(prefixes) if line.startswith(prefix)]
+        if matches:
+            i = max(matches, key=lambda i: len(prefixes[i]))
+            errors[i] = errors.get(i, "") + line.replace(str(temps[i]), names[i])
+    return errors
+
+
+# The outcome of formatting one file: (reformatted contents or None on error,
+# seconds, error message, fixup counts).
+_Outcome = tuple[bytes | None, float, str, Mapping[str, int]]
+
+
+def _format_batch(
+    batch: Sequence[tuple[str, bytes]],
+    gjf_options: Sequence[str],
+    jvm_options: Sequence[str],
+    isolating: bool = False,
+) -> list[_Outcome]:
+    """Reformat a batch of file contents using one google-java-format process.
+
+    A file that google-java-format cannot parse does not affect the others.
+    If google-java-format fails without saying which files are at fault, one
+    file is run by itself.  If that fails in the same way, the failure is not
+    about the files (for example, an invalid option), and an exception is
+    raised.  Otherwise (say, google-java-format crashed on some file), the
+    files are retried in halves, until the faulty files are isolated.
+
+    Args:
+        batch: pairs of (file name, contents)
+        gjf_options: extra command-line options for google-java-format
+        jvm_options: options for the JVM
+        isolating: true if this is a retry of part of a failed batch
+
+    Returns:
+        for each element of `batch`, a tuple of (reformatted contents or None
+        on error, seconds, error message, fixup counts).
+    """
+    with tempfile.TemporaryDirectory(prefix="run-google-java-format-") as temp_dir:
+        temps = []
+        for i, (name, contents) in enumerate(batch):
+            temp = Path(temp_dir) / f"tmp{i}_{Path(name).name}"
+            temp.write_bytes(contents)
+            temps.append(temp)
+
+        start = time.perf_counter()
+        proc = run_gjf(
+            [*gjf_options, "--replace", *map(str, temps)], jvm_options, capture_output=True
+        )
+        gjf_seconds = (time.perf_counter() - start) / len(batch)
+
+        errors: dict[int, str] = {}
+        if proc.returncode != 0:
+            names = [name for name, _ in batch]
+            stderr = proc.stderr.decode("utf-8", "replace")
+            errors = _attribute_errors(stderr, temps, names)
+            # google-java-format reports each file that it cannot format, and then
+            # exits with status 1.  Otherwise (say, if it crashed), it may have
+            # stopped before processing the files without errors.
+            if errors and proc.returncode == 1:
+                suspects = []
+            else:
+                suspects = [i for i in range(len(batch)) if i not in errors]
+            if not errors and not isolating and len(batch) > 1:
+                # google-java-format may have rewritten the temporary file, so use a fresh copy.
+                probe = Path(temp_dir) / f"probe_{Path(names[0]).name}"
+                probe.write_bytes(batch[0][1])
+                probe_proc = run_gjf(
+                    [*gjf_options, "--replace", str(probe)], jvm_options, capture_output=True
+                )
+                probe_stderr = probe_proc.stderr.decode("utf-8", "replace")
+                if probe_proc.returncode == proc.returncode and not _attribute_errors(
+                    probe_stderr, [probe], names[:1]
+                ):
+                    msg = f"Error {proc.returncode} when running google-java-format:\n" + stderr
+                    raise Exception(msg)
+            if suspects:
+                if len(batch) == 1:
+                    message = (
+                        f"Error {proc.returncode} when running google-java-format"
+                        f" on {names[0]}\n" + stderr.replace(str(temps[0]), names[0])
+                    )
+                    return [(None, gjf_seconds, message, {})]
+                if len(suspects) == len(batch):
+                    middle = len(batch) // 2
+                    retry = [suspects[:middle], suspects[middle:]]
+                else:
+                    retry = [suspects]
+                outcomes: dict[int, _Outcome] = {
+                    i: (None, gjf_seconds, message, {}) for i, message in errors.items()
+                }
+                for indices in retry:
+                    retried = _format_batch(
+                        [batch[i] for i in indices], gjf_options, jvm_options, isolating=True
+                    )
+                    outcomes.update(zip(indices, retried, strict=True))
+                return [outcomes[i] for i in range(len(batch))]
+
+        result: list[_Outcome] = []
+        for i, temp in enumerate(temps):
+            if i in errors:
+                result.append((None, gjf_seconds, errors[i], {}))
+                continue
+            start = time.perf_counter()
+            counts: Counter[str] = Counter()
+            formatted = fixup_bytes(temp.read_bytes(), counts)
+            fixups = {kind: n for kind, n in counts.items() if n}
+            result.append((formatted, gjf_seconds + time.perf_counter() - start, "", fixups))
+        return result
+
+
+def available_cpus() -> int:
+    """Return the number of CPUs that this process may use.
+
+    Accounts for the CPU affinity mask and for a cgroup (container) CPU quota.
+
+    Returns:
+        the number of CPUs that this process may use.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def available_memory() -> int | None:
+    """Return the number of bytes of memory available to new processes.
+
+    Accounts for a cgroup (container) memory limit.
+
+    Returns:
+        the number of bytes of memory available, or None if it cannot be determined.
+    """
+    available = None
+    try:
+        m = re.search(r"^MemAvailable:\s+(\d+) kB", Path("/proc/meminfo").read_text(), re.MULTILINE)
+        if m:
+            available = int(m.group(1)) * 1024
+    except OSError:
+        pass
+    if available is None:
+        # os.sysconf and these names are not available on every platform.
+        with contextlib.suppress(AttributeError, OSError, ValueError):
+            available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    try:
+        limit = Path("/sys/fs/cgroup/memory.max").read_text().strip()
+        if limit != "max":
+            usage = int(Path("/sys/fs/cgroup/memory.current").read_text())
+            in_cgroup = int(limit) - usage
+            available = in_cgroup if available is None else min(available, in_cgroup)
+    except (OSError, ValueError):
+        pass
+    return available
+
+
+def _env_int(name: str) -> int | None:
+    """Return the value of the given environment variable as a positive integer.
+
+    Returns:
+        the value of the environment variable, or None if it is unset or empty.
+    """
+    value = os.getenv(name)
+    if not value:
+        return None
+    if not value.isdigit() or int(value) == 0:
+        msg = f'{name} is "{value}"; expected a positive integer'
+        raise Exception(msg)
+    return int(value)
+
+
+@dataclasses.dataclass(frozen=True)
+class RunPlan:
+    """How to divide a run among google-java-format processes.
+
+    Attributes:
+        jobs: the number of concurrent google-java-format processes
+        files_per_job: the number of files given to each process
+        jvm_options: options for each JVM, such as its heap limit
+    """
+
+    jobs: int
+    files_per_job: int
+    jvm_options: tuple[str, ...]
+
+
+def plan_run(sizes: Sequence[int], jobs: int | None = None) -> RunPlan:
+    """Choose the processes and JVM options for formatting files of the given sizes.
+
+    The number of processes is limited by the available CPUs, and by the
+    available memory divided by the memory each JVM needs.  Each JVM's heap
+    limit depends on the largest file and the number of CPUs it may use.
+    Each job formats several batches of files, one process per batch.
+    Processes with little input stop at the JVM's quick first-tier compiler,
+    and JVMs with few CPUs use the serial garbage collector.
+
+    Environment variables GJF_JOBS and GJF_FILES_PER_JOB override the
+    corresponding choices.  GJF_JVM_OPTIONS, if set, replaces the chosen JVM
+    options; set it to the empty string to use the JVM's defaults.
+
+    Args:
+        sizes: the size in bytes of each file to be formatted
+        jobs: the maximum number of concurrent google-java-format processes;
+            overrides GJF_JOBS and the number chosen from the CPUs and memory
+
+    Returns:
+        the plan for the run.
+    """
+    num_files = max(1, len(sizes))
+    largest = max(sizes, default=0)
+    cpus = available_cpus()
+    memory = available_memory()
+    # Leave room for the rest of the system, such as the build that invoked us.
+    usable = None if memory is None else memory * 3 // 4
+
+    def heap_for(num_jobs: int) -> int:
+        threads = max(1, cpus // num_jobs)
+        return _min_heap + _heap_per_source_byte * largest * threads
+
+    jobs = jobs or _env_int("GJF_JOBS")
+    if jobs is None:
+        jobs = min(cpus, num_files)
+        if usable is not None:
+            jobs = max(1, min(jobs, usable // (heap_for(jobs) + _jvm_overhead)))
+    jobs = min(jobs, num_files)
+    files_per_job = _env_int("GJF_FILES_PER_JOB")
+    if files_per_job is None:
+        files_per_job = math.ceil(num_files / (jobs * _batches_per_job))
+        files_per_job = max(_min_files_per_job, min(_max_files_per_job, files_per_job))
+    files_per_job = min(files_per_job, num_files)
+    num_batches = math.ceil(num_files / files_per_job)
+    # There is no use for more processes than batches.
+    jobs = min(jobs, num_batches)
+
+    jvm_options_env = os.getenv("GJF_JVM_OPTIONS")
+    if jvm_options_env is not None:
+        jvm_options = tuple(shlex.split(jvm_options_env))
+    else:
+        threads = max(1, cpus // jobs)
+        # Allow headroom over the estimate, but not more than this JVM's share of memory.
+        heap = 2 * heap_for(jobs)
+        if usable is not None:
+            heap = max(_min_heap, min(heap, usable // jobs - _jvm_overhead))
+        jvm_options = (
+            f"-Xmx{heap // _mib}m",
+            f"-XX:ActiveProcessorCount={threads}",
+            "-XX:+UseSerialGC" if threads <= 2 else "-XX:+UseParallelGC",
+        )
+        if sum(sizes) // num_batches < _short_run_bytes:
+            jvm_options += ("-XX:TieredStopAtLevel=1",)
+    return RunPlan(jobs, files_per_job, jvm_options)
+
+
+def _batches(indices: Sequence[int], files_per_job: int) -> list[Sequence[int]]:
+    """Split `indices` into batches of nearly equal size, at most `files_per_job` each.
+
+    Each batch is a run of consecutive elements of `indices`, so that results
+    in input order can be reported as soon as the first batches finish.
+
+    Returns:
+        the batches.
+    """
+    num_batches = max(1, math.ceil(len(indices) / files_per_job))
+    return [
+        indices[len(indices) * i // num_batches : len(indices) * (i + 1) // num_batches]
+        for i in range(num_batches)
+    ]
+
+
+class DirectoryCache:
+    """A formatting-result cache stored in a directory, which may be on a shared file system."""
+
+    def __init__(self, directory: Path) -> None:
+        """Create a cache stored in `directory`, which is created if necessary."""
+        self.directory = directory
+
+    def get(self, key: str) -> bytes | None:
+        """Return the value for `key`, or None if there is none.
+
+        Returns:
+            the value for `key`, or None.
+        """
+        try:
+            return (self.directory / key[:2] / key).read_bytes()
+        except OSError:
+            return None
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store `value` for `key`."""
+        path = self.directory / key[:2] / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and rename it into place, so that concurrent
+        # readers (possibly on other machines) never see a partial value.
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+            tmp.write(value)
+        Path(tmp.name).replace(path)
+
+
+class HttpCache:
+    """A formatting-result cache on an HTTP server.
+
+    The value for a key is read with GET <url>/<key> and written with PUT
+    <url>/<key>.  A missing key is indicated by any error status, such as 404.
+    After the first network error or timeout, the cache is disabled for the
+    rest of the run, so an unavailable server makes the cache ineffective but
+    does not make each request wait for the timeout.
+    """
+
+    def __init__(self, url: str, timeout: float) -> None:
+        """Create a cache on the server at `url`, with the given timeout in seconds."""
+        self.url = url.rstrip("/") + "/"
+        self.timeout = timeout
+        self.disabled = False
+        self._lock = threading.Lock()
+
+    def _disable(self, error: Exception) -> None:
+        """Stop using the server, because of `error`."""
+        with self._lock:
+            if not self.disabled:
+                self.disabled = True
+                print(f"Not using cache {self.url}: {error}", file=sys.stderr)
+
+    def _request(self, request: urllib.request.Request) -> bytes | None:
+        """Send `request` to the server, unless the cache is disabled.
+
+        Returns:
+            the response body, or None on an error status or a network error.
+        """
+        if self.disabled:
+            return None
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if debug:
+                print("cache request failed:", request.get_method(), request.full_url, e)
+            return None
+        except (OSError, http.client.HTTPException) as e:
+            self._disable(e)
+            return None
+
+    def get(self, key: str) -> bytes | None:
+        """Return the value for `key`, or None if there is none.
+
+        Returns:
+            the value for `key`, or None.
+        """
+        return self._request(urllib.request.Request(self.url + key))
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store `value` for `key`."""
+        self._request(urllib.request.Request(self.url + key, data=value, method="PUT"))
+
+
+def result_cache() -> DirectoryCache | HttpCache | None:
+    """Return the formatting-result cache, as configured by environment variable GJF_CACHE.
+
+    GJF_CACHE may be a directory (local, or on a shared file system) or an
+    http:// or https:// URL.  GJF_CACHE_TIMEOUT is the timeout in seconds for
+    each request to an HTTP cache (default 5).
+
+    Returns:
+        the formatting-result cache, or None if GJF_CACHE is not set.
+    """
+    location = os.getenv("GJF_CACHE")
+    if not location:
+        return None
+    if location.startswith(("http://", "https://")):
+        return HttpCache(location, float(os.getenv("GJF_CACHE_TIMEOUT") or 5))
+    return DirectoryCache(Path(location))
+
+
+@functools.cache
+def _fixup_rules_digest() -> str:
+    """Return a hash of the fixup rules, including any added type annotations.
+
+    Returns:
+        a hash of the fixup rules.
+    """
+    digest = hashlib.sha256(fixup_py_path.read_bytes())
+    digest.update("\n".join(sorted(fixup_module().type_annotations)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_key(contents: bytes, gjf_options: Sequence[str]) -> str:
+    """Return the cache key for formatting `contents`.
+
+    The key depends on everything that affects the result: the contents, the
+    version of google-java-format, its options, and the fixup rules.
+
+    Returns:
+        the cache key for formatting `contents`.
+    """
+    digest = hashlib.sha256()
+    for part in (gjf_version(), os.getenv("GJF_SNAPSHOT", ""), *gjf_options, _fixup_rules_digest()):
+        digest.update(part.encode("utf-8") + b"\0")
+    digest.update(contents)
+    return digest.hexdigest()
+
+
+def _cache_value(fixups: Mapping[str, int]) -> bytes:
+    """Return the cache value recording that some contents are already formatted.
+
+    The value is only a verdict, not formatted contents: a cache that others
+    can write to must not be able to put code into the files being formatted.
+
+    Returns:
+        `_cache_format` and `fixups` as JSON, on one line.
+    """
+    return _cache_format + b" " + json.dumps({"fixups": fixups}).encode("utf-8") + b"\n"
+
+
+def _cached_outcome(contents: bytes, value: bytes) -> _Outcome | None:
+    """Return the formatting outcome recorded in a cache value for `contents`.
+
+    Returns:
+        the outcome of formatting `contents` unchanged, or None if `value` is
+        not a complete value in the current format (for example, if it was
+        truncated, or came from an HTTP server's error page).
+    """
+    marker, _, header = value.partition(b" ")
+    if marker != _cache_format or not header.endswith(b"\n"):
+        return None
+    try:
+        fixups = json.loads(header)["fixups"]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(fixups, dict):
+        return None
+    return (contents, 0.0, "", fixups)
+
+
+def _file_result(item: tuple[str, bytes], outcome: _Outcome) -> tuple[FileResult, bytes | None]:
+    """Return the result of formatting one file.
+
+    Args:
+        item: the pair of (file name, contents)
+        outcome: the outcome of formatting the contents
+
+    Returns:
+        the result, and the reformatted contents (None on error).
+    """
+    name, contents = item
+    formatted, seconds, message, fixups = outcome
+    if formatted is None:
+        status = ERROR
+    elif formatted == contents:
+        status = UNCHANGED
+    else:
+        status = CHANGED
+    return FileResult(name, status, seconds, message, fixups), formatted
+
+
+def iter_format_contents(
+    items: Sequence[tuple[str, bytes]],
+    *,
+    jobs: int | None = None,
+    gjf_options: Sequence[str] = (),
+    ordered: bool = False,
+) -> Iterator[tuple[int, FileResult, bytes | None]]:
+    """Reformat the given file contents, yielding each result as soon as it is available.
+
+    Like `format_contents`, but the results of a batch are yielded when that
+    batch finishes, while later batches are still running.  Items that the
+    result cache records as already formatted are yielded first.
+
+    Args:
+        items: pairs of (file name, contents).  The file name is used only for
+            reporting.
+        jobs: the maximum number of concurrent google-java-format processes;
+            default is chosen by `plan_run()`
+        gjf_options: extra command-line options for google-java-format
+        ordered: if true, yield the results in the order of `items`.  A result
+            that finishes early is held until all the results before it have
+            been yielded.  Because batches are consecutive runs of `items` and
+            start in order, few results are held.
+
+    Yields:
+        for each element of `items`, its index in `items`, its result, and its
+        reformatted contents (None on error).
+    """
+    ready: dict[int, _Outcome] = {}  # outcomes that have not been yielded yet
+    next_index = 0  # if `ordered`, the index of the next result to yield
+
+    def take_ready() -> Iterator[tuple[int, FileResult, bytes | None]]:
+        nonlocal next_index
+        indices = []
+        if ordered:
+            while next_index in ready:
+                indices.append(next_index)
+                next_index += 1
+        else:
+            indices = sorted(ready)
+        for i in indices:
+            result, formatted = _file_result(items[i], ready.pop(i))
+            yield i, result, formatted
+
+    to_format = list(range(len(items)))
+    cache = result_cache()
+    keys = []
+    if cache is not None:
+        keys = [_cache_key(contents, gjf_options) for _, contents in items]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_cache_threads) as lookups:
+            values = list(lookups.map(cache.get, keys))
+        to_format = []
+        for i, value in enumerate(values):
+            outcome = None if value is None else _cached_outcome(items[i][1], value)
+            if outcome is None:
+                to_format.append(i)
+            else:
+                ready[i] = outcome
+        yield from take_ready()
+    if not to_format:
+        return
+
+    plan = plan_run([len(items[i][1]) for i in to_format], jobs)
+    # Set when a batch raises an exception, so that the batches not yet started are skipped.
+    failed = threading.Event()
+
+    def format_batch(batch: Sequence[int]) -> list[_Outcome] | None:
+        if failed.is_set():
+            return None
+        try:
+            return _format_batch([items[i] for i in batch], gjf_options, plan.jvm_options)
+        except Exception:
+            failed.set()
+            raise
+
+    with (
+        concurrent.futures.ThreadPoolExecutor(max_workers=plan.jobs) as executor,
+        concurrent.futures.ThreadPoolExecutor(max_workers=_cache_threads) as cache_writes,
+    ):
+        futures = {
+            executor.submit(format_batch, batch): batch
+            for batch in _batches(to_format, plan.files_per_job)
+            if batch
+        }
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                outcomes = future.result()
+                if outcomes is None:
+                    continue
+                for i, outcome in zip(futures[future], outcomes, strict=True):
+                    ready[i] = outcome
+                    formatted, _, _, fixups = outcome
+                    if cache is not None and formatted == items[i][1]:
+                        # Write behind: formatting continues while the verdict is stored.
+                        cache_writes.submit(cache.put, keys[i], _cache_value(fixups))
+                # Other batches keep running while the caller handles these results.
+                yield from take_ready()
+        finally:
+            # If a batch raised an exception, or the caller stopped early, don't
+            # start the batches that are still queued.
+            for future in futures:
+                future.cancel()
+
+
+def format_contents(
+    items: Sequence[tuple[str, bytes]],
+    *,
+    jobs: int | None = None,
+    gjf_options: Sequence[str] = (),
+) -> list[tuple[FileResult, bytes | None]]:
+    """Reformat the given file contents, without reading or writing the files.
+
+    This is useful when the contents do not come from the file system, such
+    as blobs in the git index.  The items are divided into batches, and each
+    batch is formatted by its own google-java-format process.  The batches run
+    concurrently.  If a result cache is configured (see `result_cache()`),
+    items that the cache records as already formatted are not formatted
+    again, and items found to be already formatted are added to the cache.
+
+    Args:
+        items: pairs of (file name, contents).  The file name is used only for
+            reporting.
+        jobs: the maximum number of concurrent google-java-format processes;
+            default is chosen by `plan_run()`
+        gjf_options: extra command-line options for google-java-format
+
+    Returns:
+        for each element of `items`, in order, its result and its reformatted
+        contents (None on error).
+    """
+    return [
+        (result, formatted)
+        for _, result, formatted in iter_format_contents(
+            items, jobs=jobs, gjf_options=gjf_options, ordered=True
+        )
+    ]
+
+
+def iter_format_files(
+    paths: Iterable[str | os.PathLike[str]],
+    *,
+    jobs: int | None = None,
+    check_only: bool = False,
+    gjf_options: Sequence[str] = (),
+    ordered: bool = False,
+) -> Iterator[FileResult]:
+    """Reformat the given files, in place, yielding each result as soon as it is available.
+
+    Like `format_files`, but each file is rewritten, and its result yielded,
+    when its batch finishes.  See `iter_format_contents`.
+
+    Args:
+        paths: the .java files to format
+        jobs: the maximum number of concurrent google-java-format processes;
+            default is chosen by `plan_run()`
+        check_only: if true, do not modify any file; just report which files
+            would be changed
+        gjf_options: extra command-line options for google-java-format
+        ordered: if true, yield the results in the same order as `paths`
+
+    Yields:
+        one result per file.  A file that cannot be read has an ERROR result.
+    """
+    items = []
+    positions = []  # for each element of `items`, its index in `paths`
+    unreadable: dict[int, FileResult] = {}  # results, by index in `paths`, not yet yielded
+    for position, path in enumerate(paths):
+        name = os.fspath(path)
+        try:
+            items.append((name, Path(name).read_bytes()))
+            positions.append(position)
+        except OSError as e:
+            message = f"{name}: error: could not read file: {e.strerror or e}\n"
+            unreadable[position] = FileResult(name, ERROR, 0.0, message)
+    if not ordered:
+        yield from unreadable.values()
+        unreadable.clear()
+
+    for i, result, formatted in iter_format_contents(
+        items, jobs=jobs, gjf_options=gjf_options, ordered=ordered
+    ):
+        for position in sorted(p for p in unreadable if p < positions[i]):
+            yield unreadable.pop(position)
+        if formatted is not None and result.status == CHANGED and not check_only:
+            Path(result.path).write_bytes(formatted)
+        yield result
+    for position in sorted(unreadable):
+        yield unreadable[position]
+
+
+def format_files(
+    paths: Iterable[str | os.PathLike[str]],
+    *,
+    jobs: int | None = None,
+    check_only: bool = False,
+    gjf_options: Sequence[str] = (),
+) -> list[FileResult]:
+    """Reformat the given files, in place.
+
+    A file's contents are rewritten only if formatting changes them.
+
+    Args:
+        paths: the .java files to format
+        jobs: the maximum number of concurrent google-java-format processes;
+            default is chosen by `plan_run()`
+        check_only: if true, do not modify any file; just report which files
+            would be changed
+        gjf_options: extra command-line options for google-java-format
+
+    Returns:
+        one result per file, in the same order as `paths`.
+    """
+    return list(
+        iter_format_files(
+            paths, jobs=jobs, check_only=check_only, gjf_options=gjf_options, ordered=True
+        )
+    )
+
+
+def main() -> None:
+    """Reformat each file supplied on the command line."""
+    args = sys.argv[1:]
+    if len(args) == 0:
+        print("run-google-java-format.py expects 1 or more filenames as arguments")
+        sys.exit(1)
+
+    gjf_options = [a for a in args if a.startswith("-")]
+    files = [a for a in args if not a.startswith("-")]
+    # If no files were supplied (maybe "--help" was supplied), just run google-java-format.
+    if not files:
+        sys.exit(run_gjf(gjf_options).returncode)
+
+    if debug:
+        print("gjf_jar_path: ", gjf_jar_path())
+
+    # A file with errors is left unchanged, but the other files are still formatted.
+    exit_code = 0
+    try:
+        for result in iter_format_files(files, gjf_options=gjf_options):
+            if result.status == ERROR:
+                print(result.message, end="", file=sys.stderr)
+                exit_code = 1
+    except Exception as e:  # ruff:ignore[blind-except]
+        # A failure that is not about particular files, such as an invalid option.
+        print(str(e).rstrip("\n"), file=sys.stderr)
+        exit_code = 1
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()